@@ -42,8 +42,11 @@ parameters (-o -t) which most other commands need.
 
 NOTE: EDDEP will try to figure out the name of the system-station pair from
 a substring of it. So often times it will be enough to enter just 'Nourse'
-instead of the full 'Esumindii.Nourse City'. Also note that for strings not
-involving whitespace EDDEP does not need the string to be quoted.
+instead of the full 'Esumindii.Nourse City'. An exact name is preferred, then
+names starting with the snippet, then names merely containing it, so 'Sol'
+picks a station in the Sol system before 'Achenar.Sol Base'. Also note that
+for strings not involving whitespace EDDEP does not need the string to be
+quoted.
 
 ./systems.py -o Nourse buy
 
@@ -83,9 +86,16 @@ to a value below the default 500 credits.
 """
 
 import argparse
-import glob
+import bisect
+import collections
+import concurrent.futures
+import csv
+import datetime
+import itertools
 import logging
 import os
+import re
+import sys
 
 HELP_TXT = """Command can be one of:
 
@@ -97,8 +107,25 @@ sell: lists all station buy prices at location.
 trade2: lists possible trades between origin and target location.
 ferengi: list high trades in known systems."""
 
+# Locations ferengi never uses as a trade origin.
+SKIP_LOCATIONS = frozenset({'Shinrarta Dezhra.Jameson Memorial'})
+
+# Below this many station pairs ferengi runs serially, a process pool costs
+# more to start than the pairs take to evaluate.
+PARALLEL_MIN_PAIRS = 10000
+
+# EDMC data file names, e.g. 'Sol.Galileo.2017-03-02T09.01.02.csv', matching
+# system, station, the six date fields and the file type.
+FILE_RE = re.compile(r'^(.+?)\.(.+?)\.(\d{4})-(\d{2})-(\d{2})'
+                     r'T(\d{2})\.(\d{2})\.(\d{2}).*\.(csv|prices)$')
+
+# Parsed csv row: sell is what the station pays for the item, buy is what it
+# charges, then demand level and supply. Empty price and supply cells parse as
+# 0, EDMC leaves buy and supply empty when the item is not for sale.
+Item = collections.namedtuple('Item', ['name', 'sell', 'buy', 'demand',
+                                       'supply'])
+
 LOGGER = logging.getLogger('systems.py')
-LOGGER.setLevel(logging.DEBUG)
 # create console handler
 CH = logging.StreamHandler()
 # Select desired logging level
@@ -109,6 +136,8 @@ FORMATTER = logging.Formatter('%(levelname)s %(asctime)s %(name)s:%(lineno)s] '
 CH.setFormatter(FORMATTER)
 # add ch to logger
 LOGGER.addHandler(CH)
+# Follow the handler level so disabled debug calls are skipped early.
+LOGGER.setLevel(CH.level)
 
 
 class SystemsException(Exception):
@@ -126,102 +155,158 @@ class Utils:
 
   @classmethod
   def location_matcher(cls, location_snippet, locations):
-    """Match first location in locations based on snippet."""
-    matched_location = ''
-    for location in locations:
-      if location_snippet in location:
-        print('%s setting location to: %s' % (location_snippet, location))
-        matched_location = location
-        break
-    if not matched_location:
+    """Match first location in locations based on snippet.
+
+    An exact match wins, then the first location starting with the snippet,
+    then the first location containing it. locations must be sorted.
+    """
+    # Sorted order puts an exact match right before the locations it prefixes.
+    position = bisect.bisect_left(locations, location_snippet)
+    if (position < len(locations) and
+        locations[position].startswith(location_snippet)):
+      matched_location = locations[position]
+    else:
+      matched_location = next(
+          (location for location in locations if location_snippet in location),
+          '')
+    if matched_location:
+      print('%s setting location to: %s' % (location_snippet, matched_location))
+    else:
       print('No visited location matches {}.'.format(location_snippet))
       raise LocationException('Missing location.')
     LOGGER.debug('Matched location=%s', matched_location)
     return matched_location
 
   @classmethod
-  def read_csv(cls, location, csv_files):
-    """Return location's csv file contents as list of lines."""
-    if not location:
+  def parse_data_file(cls, filename):
+    """Return (location, datetime) of an EDMC csv or prices file name."""
+    match = FILE_RE.match(filename)
+    location = '%s.%s' % match.group(1, 2)
+    date_fields = match.group(3, 4, 5, 6, 7, 8)
+    date = datetime.datetime(*[int(field) for field in date_fields])
+    return location, date
+
+  @classmethod
+  def iter_items(cls, location, csv_by_location):
+    """Yield location's csv items split into columns, one line at a time."""
+    if not location or location not in csv_by_location:
       raise LocationException('Missing location.')
-    for file in csv_files:
-      if location in file:
-        LOGGER.debug('Reading data from file: %s', file)
-        with open(file) as csvfile:
-          items = csvfile.readlines()
-    # Skip the header only return items.
-    return items[1:]
+    location_file = csv_by_location[location]
+    LOGGER.debug('Reading data from file: %s', location_file)
+    with open(location_file, newline='') as csvfile:
+      # Skip the header only yield items.
+      next(csvfile, None)
+      yield from csv.reader(csvfile, delimiter=';')
+
+  @classmethod
+  def scan_trades(cls, origin_offers, target_bids, lowest_profit):
+    """Return trades above lowest_profit from origin offers to target bids.
+
+    origin_offers maps item to (buy price, supply) for items on sale at the
+    origin, target_bids maps item to the target's sell price. Returns a list
+    of (item, buy price, supply, sell price, profit) tuples.
+    """
+    trades = []
+    for item, (buy_price, supply) in origin_offers.items():
+      sell_price = target_bids.get(item)
+      if sell_price is not None:
+        profit = sell_price - buy_price
+        if profit > lowest_profit:
+          trades.append((item, buy_price, supply, sell_price, profit))
+    return trades
+
+  @classmethod
+  def format_trade(cls, item, buy_price, supply, sell_price, profit):
+    """Return a trade as a single output table row."""
+    return (f'{item:30} {buy_price:>5} cr {supply:>7} t supply'
+            f' | sell@ {sell_price:>5} cr | Profit: {profit:>5}')
+
+  @classmethod
+  def station_pair_report(cls, origin, target, origin_offers, target_bids,
+                          lowest_profit):
+    """Return output lines for trades above lowest_profit, origin to target."""
+    trades = cls.scan_trades(origin_offers, target_bids, lowest_profit)
+    if not trades:
+      LOGGER.debug('Items not found with profit > %s Cr.', lowest_profit)
+    out = []
+    for trade in trades:
+      out.append(f'{origin} ---> {target}')
+      out.append(cls.format_trade(*trade))
+    return out
+
+  @classmethod
+  def eval_pair(cls, origin, target, offers, bids, forward, backward,
+                lowest_profit):
+    """Return output lines for the requested directions of a location pair.
+
+    offers and bids map each location to its offers and bids dicts.
+    """
+    out = []
+    if forward:
+      out.extend(cls.station_pair_report(origin, target, offers[origin],
+                                         bids[target], lowest_profit))
+    if backward:
+      out.extend(cls.station_pair_report(target, origin, offers[target],
+                                         bids[origin], lowest_profit))
+    return out
 
 
 class Systems:
   """Class to encapsulate systems related data and methods."""
 
   def __init__(self):
-    self.csv_files = glob.glob('*[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T'
-                               '[0-9][0-9].[0-9][0-9].[0-9][0-9]*.csv')
-    self.prices_files = glob.glob('*[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]T'
-                                  '[0-9][0-9].[0-9][0-9].[0-9][0-9]*.prices')
-    self.locations_dict = {}
+    self.csv_files = []
+    self.prices_files = []
+    # Classify csv and prices data files in a single directory pass.
+    with os.scandir('.') as entries:
+      for entry in entries:
+        if entry.name.startswith('.') or not entry.is_file():
+          continue
+        match = FILE_RE.match(entry.name)
+        if not match:
+          continue
+        if match.group(9) == 'csv':
+          self.csv_files.append(entry.name)
+        else:
+          self.prices_files.append(entry.name)
     self.locations = []
-    self.most_recent_locations = []
+    self.csv_by_location = {}
+    self.utils = Utils()
+    self._items_cache = {}
+    # Per location item to (buy price, supply) for items on sale, and item to
+    # sell price, precomputed for the trade scans.
+    self._offers = {}
+    self._bids = {}
+    # Locations selling at least one item and buying at least one item.
+    self.sellers = set()
+    self.buyers = set()
     self._find_locations()
     if not os.path.exists('tmp'):
       os.makedirs('tmp')
-    self.utils = Utils()
 
   def _find_locations(self):
-    """Initialize locations dict and list."""
+    """Initialize locations list and csv file lookup."""
+    seen = set()
     for filename in self.csv_files:
-      file_fields = filename.split('.')
-      LOGGER.debug('file_fields=%r', file_fields)
-      location = '%s.%s' % (file_fields[0], file_fields[1])
-      if location not in self.locations_dict:
-        self.locations_dict[location] = 1
-    self.locations = sorted(list(self.locations_dict.keys()))
+      location, _ = self.utils.parse_data_file(filename)
+      LOGGER.debug('location=%s, file=%s', location, filename)
+      seen.add(location)
+      self.csv_by_location[location] = filename
+    self.locations = sorted(seen)
 
   def clean(self):
     """Remove all but newest csv and prices data files."""
     files = {}
     for file in self.csv_files:
-      location, station, date = file.split('.', 2)
-      location = '%s.%s' % (location, station)
-      date = date.replace('.', '-', 2)
-      date = date.replace('T', '-')
-      date = date.split('.')[0]
-      if location in files:
-        prev_date = files[location]
-        prev_tokens = prev_date.split('-')
-        new_tokens = date.split('-')
-        # Compare the dates components and select the date
-        # with the bigger component
-        for prev_token, new_token in zip(prev_tokens, new_tokens):
-          if int(new_token) > int(prev_token):
-            files[location] = date
-            break
-      else:
-        # No previous record for this file
+      location, date = self.utils.parse_data_file(file)
+      # Keep the newest date seen for each location.
+      if location not in files or date > files[location]:
         files[location] = date
-    # Fix dates back to filename form.
-    for location in files:
-      date = list(files[location])
-      date[10] = 'T'
-      date[13] = '.'
-      date[16] = '.'
-      file_date = ''.join(date)
-      files[location] = file_date
-      self.most_recent_locations.append('%s.%s' % (location, file_date))
-      self.most_recent_locations.sort()
-    LOGGER.debug(self.most_recent_locations)
-    # Clean up csv files.
-    for file in self.csv_files:
-      if file.split('.csv')[0] not in self.most_recent_locations:
-        print('Removing: %s' % file)
-        os.remove(file)
-      else:
-        print('Keeping most recent: %s' % file)
-    # Clean up prices files.
-    for file in self.prices_files:
-      if file.split('.prices')[0] not in self.most_recent_locations:
+    LOGGER.debug('Most recent dates: %r', files)
+    # Clean up csv and prices files.
+    for file in self.csv_files + self.prices_files:
+      location, date = self.utils.parse_data_file(file)
+      if files.get(location) != date:
         print('Removing: %s' % file)
         os.remove(file)
       else:
@@ -243,92 +328,121 @@ class Systems:
     """List goods for sale at station."""
     # Get full location name from snippet.
     location = self.utils.location_matcher(location, self.locations)
-    # Match csv fil and get items.
-    location_items = self.utils.read_csv(location, self.csv_files)
+    # Match csv file and get items.
+    location_items = self._get_items(location)
     if not location_items:
       return
     print('ITEM, LOCATION SELL PRICE, QUANTITY AVAILABLE - {}'.format(location))
     for item in location_items:
-      columns = item.split(';')
-      if columns[7]:
-        print('{:30} {:>5} Cr {:>8} t'.format(columns[2], int(columns[4]),
-                                              int(columns[7])))
+      if item.supply:
+        print('{:30} {:>5} Cr {:>8} t'.format(item.name, item.buy, item.supply))
+
   def list_goods_prices(self, location):
     """List which can be sold at station."""
     # Get full location name from snippet.
     location = self.utils.location_matcher(location, self.locations)
     # Match csv file and get items.
-    location_items = self.utils.read_csv(location, self.csv_files)
+    location_items = self._get_items(location)
     if not location_items:
       return
     print('ITEM, LOCATION Buy PRICE, DEMAND - {}'.format(location))
     for item in location_items:
-      columns = item.split(';')
-      print('{:30} {:>5} Cr {}'.format(columns[2], int(columns[3]),
-                                       columns[6]))
+      print('{:30} {:>5} Cr {}'.format(item.name, item.sell, item.demand))
+
+  def _get_items(self, location):
+    """Return location's parsed csv items, reading the file only once."""
+    if location not in self._items_cache:
+      items = []
+      for columns in self.utils.iter_items(location,
+                                            self.csv_by_location):
+        sell = int(columns[3]) if columns[3] else 0
+        buy = int(columns[4]) if columns[4] else 0
+        supply = int(columns[7]) if columns[7] else 0
+        # Commodity names repeat across every location, share one string
+        # per name so dict probes in the trade scans match on identity.
+        items.append(Item(sys.intern(columns[2]), sell, buy, columns[6],
+                          supply))
+      self._items_cache[location] = items
+      offers = {item.name: (item.buy, item.supply)
+                for item in items if item.supply}
+      self._offers[location] = offers
+      self._bids[location] = {item.name: item.sell for item in items}
+      if offers:
+        self.sellers.add(location)
+      if any(item.sell for item in items):
+        self.buyers.add(location)
+    return self._items_cache[location]
 
   def trade2(self, origin, target):
     """List most profitable trade items between two locations."""
     LOGGER.debug('origin=%s, target=%s', origin, target)
     LOGGER.debug('systems.locations=%r', self.locations)
-    LOGGER.debug(self.csv_files)
+    LOGGER.debug('csv_files=%r', self.csv_files)
     # Get full location name from snippet.
     origin = self.utils.location_matcher(origin, self.locations)
     target = self.utils.location_matcher(target, self.locations)
     # Match csv file and get items.
-    origin_items = self.utils.read_csv(origin, self.csv_files)
-    target_items = self.utils.read_csv(target, self.csv_files)
-    print('Origin location: {} Target location: {}'.format(origin, target))
-    for o_item in origin_items:
-      o_columns = o_item.split(';')
-      for t_item in target_items:
-        t_columns = t_item.split(';')
-        # If the item is available for purchase in the origin system.
-        # And its the same item on both systems.
-        if o_columns[7] and o_columns[2] == t_columns[2]:
-          sell_price = int(t_columns[3])
-          buy_price = int(o_columns[4])
-          profit = sell_price - buy_price
-          if profit > 0:
-            print('{:30} {:>5} cr {:>7} t supply'.format(
-                o_columns[2], int(o_columns[4]), int(o_columns[7])), end='')
-            print(' | sell@ {:>5} cr | Profit: {:>5}'.format(int(t_columns[3]), profit))
-
-  def profits_for_station_pair(self, origin, target, lowest_profit):
-    """Output profits between two stations"""
-    origin_items = self.utils.read_csv(origin, self.csv_files)
-    target_items = self.utils.read_csv(target, self.csv_files)
-    for o_item in origin_items:
-      o_columns = o_item.split(';')
-      for t_item in target_items:
-        t_columns = t_item.split(';')
-        # If the item is available for purchase in the origin system.
-        # And its the same item on both systems.
-        if o_columns[7] and o_columns[2] == t_columns[2]:
-          sell_price = int(t_columns[3])
-          buy_price = int(o_columns[4])
-          profit = sell_price - buy_price
-          if profit > int(lowest_profit):
-            print('{} ---> {}'.format(origin, target))
-            print('{:30} {:>5} cr {:>7} t supply'.format(
-                o_columns[2], int(o_columns[4]), int(o_columns[7])), end='')
-            print(' | sell@ {:>5} cr | Profit: {:>5}'.format(
-                int(t_columns[3]), profit))
-          else:
-            LOGGER.debug('Item: %s, Profit: %s', o_columns[2], profit)
-            LOGGER.debug('Items not found with profit > %s Cr.',
-                         lowest_profit)
+    self._get_items(origin)
+    self._get_items(target)
+    out = [f'Origin location: {origin} Target location: {target}']
+    for trade in self.utils.scan_trades(self._offers[origin],
+                                        self._bids[target], 0):
+      out.append(self.utils.format_trade(*trade))
+    sys.stdout.write('\n'.join(out) + '\n')
 
   def high_trades(self, lowest_profit=500):
     """Find locations with highest trades between them."""
-    # Iterate through all EDMC location pairs.
+    lowest_profit = int(lowest_profit)
+    # Parse every location up front to know which ones sell and buy.
+    for location in self.locations:
+      self._get_items(location)
+    # Iterate through all EDMC location pairs, checking the trades in both
+    # directions. A direction is skipped when its origin sells nothing or is
+    # in SKIP_LOCATIONS, or when its target buys nothing.
     print(self.locations)
-    for origin in self.locations:
-      for target in self.locations:
-        if origin == target or origin == 'Shinrarta Dezhra.Jameson Memorial':
-          continue
-        else:
-          self.profits_for_station_pair(origin, target, lowest_profit)
+    origins = self.sellers - SKIP_LOCATIONS
+    jobs = []
+    for origin, target in itertools.combinations(self.locations, 2):
+      forward = origin in origins and target in self.buyers
+      backward = target in origins and origin in self.buyers
+      if forward or backward:
+        jobs.append((origin, target, forward, backward, lowest_profit))
+    markets = (self._offers, self._bids)
+    workers = os.cpu_count() or 1
+    if len(jobs) >= PARALLEL_MIN_PAIRS and workers > 1:
+      # Ship the markets to each worker once rather than with every job.
+      with concurrent.futures.ProcessPoolExecutor(
+          max_workers=workers, initializer=_init_worker,
+          initargs=(markets,)) as executor:
+        results = list(executor.map(_eval_pair, jobs, chunksize=32))
+    else:
+      results = [_eval_pair(job, markets) for job in jobs]
+    for out in results:
+      if out:
+        sys.stdout.write('\n'.join(out) + '\n')
+
+
+# Offers and bids of every location, set in each ferengi worker process.
+_WORKER_MARKETS = ({}, {})
+
+
+def _init_worker(markets):
+  """Store the location offers and bids in a ferengi worker process."""
+  global _WORKER_MARKETS
+  _WORKER_MARKETS = markets
+
+
+def _eval_pair(job, markets=None):
+  """Return ferengi output lines for a high_trades job.
+
+  Offers and bids come from markets, or from the worker's copy when not given.
+  """
+  if markets is None:
+    markets = _WORKER_MARKETS
+  offers, bids = markets
+  origin, target, forward, backward, lowest_profit = job
+  return Utils.eval_pair(origin, target, offers, bids, forward, backward,
+                         lowest_profit)
 
 
 def main():